@@ -1,10 +1,277 @@
 import json
-from typing import Dict, Any
+import time
+import asyncio
+import collections
+import functools
+from typing import Dict, Any, Optional, Sequence
 from google.adk.agents import LlmAgent
 from google.adk.models.google_llm import Gemini
 from google.genai import types
 
+# Gemini 2.5 Flash-Lite free tier allows 15 RPM. Navigator/Commander calls
+# are held to 13 to leave headroom for requests that don't go through the
+# limiter: the summarisation calls made by the Navigator's
+# EventsCompactionConfig. A 429 is costly, as retries back off with exp_base=7.
+LLM_RPM = 13
+
+class RateLimiter:
+    """
+    Sliding-window rate limiter shared by every Gemini call.
+    
+    Keeps the timestamps of the last `rpm` requests and only waits when a
+    new request would exceed `rpm` requests per minute, so time spent inside
+    the LLM call itself counts towards the window instead of being added on
+    top of a fixed sleep.
+    
+    Usage:
+        limiter = RateLimiter(rpm=LLM_RPM)
+        async with limiter:
+            ...  # one LLM request
+    """
+    def __init__(self, rpm: int, period: float = 60.0):
+        self.rpm = rpm
+        self.period = period
+        self.tokens = collections.deque(maxlen=rpm)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                # Drop requests that have left the window
+                while self.tokens and now - self.tokens[0] >= self.period:
+                    self.tokens.popleft()
+                if len(self.tokens) < self.rpm:
+                    break
+                await asyncio.sleep(self.period - (now - self.tokens[0]))
+            self.tokens.append(time.monotonic())
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+class ResponseCache:
+    """
+    Agent response cache shared by all concurrently running episodes.
+    
+    Entries are the tasks that produce the response, so when several
+    episodes ask for the same key at once they await a single in-flight
+    LLM call instead of each issuing their own. Failed, cancelled or
+    None results are evicted so the next request retries.
+    
+    When given a sqlite3 connection, responses are also persisted to
+    `table` (JSON-encoded key/value), so later runs warm-start from
+    earlier ones.
+    
+    Usage:
+        advice_cache = ResponseCache(sqlite3.connect("armstrong_cache.db"), "advice")
+        advice = await advice_cache.get(telemetry_key, fetch_advice)
+    """
+    def __init__(self, conn=None, table=None):
+        self._tasks = {}
+        self._conn = conn
+        self._table = table
+        if conn is not None:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, val TEXT)"
+            )
+            conn.commit()
+
+    async def get(self, key, fetch):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load_or_fetch(key, fetch))
+            task.add_done_callback(functools.partial(self._evict_unusable, key))
+            self._tasks[key] = task
+        # Shield so one cancelled waiter doesn't cancel the shared request
+        return await asyncio.shield(task)
+
+    def clear(self):
+        """Drops all cached responses, including the persisted ones."""
+        self._tasks.clear()
+        if self._conn is not None:
+            self._conn.execute(f"DELETE FROM {self._table}")
+            self._conn.commit()
+
+    async def _load_or_fetch(self, key, fetch):
+        if self._conn is None:
+            return await fetch()
+        
+        db_key = json.dumps(key)
+        row = self._conn.execute(
+            f"SELECT val FROM {self._table} WHERE key = ?", (db_key,)
+        ).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        
+        result = await fetch()
+        if result is not None:
+            # Commit per insert: negligible next to the LLM call it saves
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self._table} (key, val) VALUES (?, ?)",
+                (db_key, json.dumps(result))
+            )
+            self._conn.commit()
+        return result
+
+    def _evict_unusable(self, key, task):
+        if task.cancelled() or task.exception() is not None or task.result() is None:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+async def ensure_session(session_service, app_name: str, user_id: str, session_id: str):
+    """
+    Returns the session if it already exists, otherwise creates it.
+    """
+    session = await session_service.get_session(
+        app_name=app_name,
+        user_id=user_id,
+        session_id=session_id
+    )
+    if session is not None:
+        return session
+    return await session_service.create_session(
+        app_name=app_name,
+        user_id=user_id,
+        session_id=session_id
+    )
+
+async def ask_navigator(runner, user_id: str, session_id: str, telemetry_desc: str,
+                        limiter: RateLimiter) -> str:
+    """
+    Sends a telemetry description to the Navigator and returns its advice.
+    
+    Args:
+        runner: Runner for the Navigator App
+        user_id: User the session belongs to
+        session_id: Navigator session, kept across steps for trend memory
+        telemetry_desc: Natural language telemetry description
+        limiter: Shared RateLimiter; the call takes one request slot
+    
+    Returns:
+        The Navigator's final response text, "" if it gave none
+    """
+    navigator_query = types.Content(
+        role="user",
+        parts=[types.Part(text=telemetry_desc)]
+    )
+    
+    advice = ""
+    async with limiter:
+        async for event in runner.run_async(
+            user_id=user_id,
+            session_id=session_id,
+            new_message=navigator_query
+        ):
+            if event.is_final_response() and event.content and event.content.parts:
+                advice = event.content.parts[0].text
+    return advice
+
+async def ask_commander(runner, session_service, app_name: str, user_id: str, session_id: str,
+                        telemetry_desc: str, advice: str, limiter: RateLimiter,
+                        timeout: float = 30.0) -> Optional[Dict[str, Any]]:
+    """
+    Asks the Commander for a maneuver in a fresh single-turn session.
+    
+    The Commander only needs the current telemetry + advice, so carrying
+    prior turns would just re-prefill an ever-growing history on every
+    step. The session is deleted again afterwards, and the event stream is
+    closed at the first function call since anything after it is unused.
+    
+    Args:
+        runner: Runner for the Commander
+        session_service: Session service shared with the runner
+        app_name: App name the session is created under
+        user_id: User the session belongs to
+        session_id: Id for the temporary session, unique per decision
+        telemetry_desc: Natural language telemetry description
+        advice: Navigator advice for the same telemetry
+        limiter: Shared RateLimiter; the call takes one request slot
+        timeout: Seconds to wait for the function call (excluding rate limiting)
+    
+    Returns:
+        {"action": str, "duration": int, "reasoning": str}, or None when the
+        Commander timed out, made no execute_maneuver call or made an invalid one
+    """
+    commander_prompt = types.Content(
+        role="user",
+        parts=[types.Part(text=f"""
+            Current Telemetry: {telemetry_desc}
+            Navigator Advice: {advice}
+            
+            Determine the best maneuver and execute it using the execute_maneuver tool.
+            """)]
+    )
+    
+    cmd_session = await session_service.create_session(
+        app_name=app_name,
+        user_id=user_id,
+        session_id=session_id
+    )
+    
+    async def first_function_call():
+        events = runner.run_async(
+            user_id=user_id,
+            session_id=cmd_session.id,
+            new_message=commander_prompt
+        )
+        try:
+            async for event in events:
+                parts = getattr(event.content, 'parts', None) or []
+                for part in parts:
+                    if getattr(part, 'function_call', None):
+                        return part.function_call
+            return None
+        finally:
+            await events.aclose()
+    
+    try:
+        # Wait for a rate limit slot outside of the timeout window
+        await limiter.acquire()
+        fn = await asyncio.wait_for(first_function_call(), timeout=timeout)
+    except asyncio.TimeoutError:
+        print("[WARNING] Commander timeout - using fallback HOLD")
+        fn = None
+    finally:
+        await session_service.delete_session(
+            app_name=app_name,
+            user_id=user_id,
+            session_id=cmd_session.id
+        )
+    
+    if fn is None:
+        return None
+    
+    # The stream is closed before ADK runs the tool, so its validation is
+    # applied here; an invalid call must not become a (cached) decision
+    try:
+        duration = int(fn.args.get("duration", 1))
+    except (TypeError, ValueError):
+        duration = 0  # Out of range, rejected below
+    result = execute_maneuver(
+        fn.args.get("action", "HOLD"),
+        duration,
+        fn.args.get("reasoning", "No reasoning provided")
+    )
+    if result["status"] != "success":
+        print(f"[WARNING] Invalid Commander call - {result['error_message']}")
+        return None
+    return {
+        "action": result["action"],
+        "duration": result["duration"],
+        "reasoning": result["reasoning"]
+    }
+
+# Decision used when the Commander gives none (timeout, no or invalid tool call)
+FALLBACK_DECISION = {"action": "HOLD", "duration": 1, "reasoning": "Fallback"}
+
 # Tool Definition - ADK Function Tool Pattern
+_VALID_ACTIONS = frozenset({"MAIN_ENGINE", "LEFT_ENGINE", "RIGHT_ENGINE", "HOLD"})
+_VALID_ACTIONS_MSG = ", ".join(sorted(_VALID_ACTIONS))
+
 def execute_maneuver(action: str, duration: int, reasoning: str) -> Dict[str, Any]:
     """
     Executes a maneuver on the lunar lander.
@@ -29,11 +296,10 @@ def execute_maneuver(action: str, duration: int, reasoning: str) -> Dict[str, An
         Error: {"status": "error", "error_message": str}
     """
     # Validate action
-    valid_actions = ["MAIN_ENGINE", "LEFT_ENGINE", "RIGHT_ENGINE", "HOLD"]
-    if action not in valid_actions:
+    if action not in _VALID_ACTIONS:
         return {
             "status": "error",
-            "error_message": f"Invalid action '{action}'. Must be one of: {', '.join(valid_actions)}"
+            "error_message": f"Invalid action '{action}'. Must be one of: {_VALID_ACTIONS_MSG}"
         }
     
     # Validate duration
@@ -50,6 +316,33 @@ def execute_maneuver(action: str, duration: int, reasoning: str) -> Dict[str, An
         "reasoning": reasoning
     }
 
+def cheap_advice(state: Sequence[float]) -> Optional[str]:
+    """
+    Answers the clear-cut cases of the Navigator's PHYSICS RULES without an LLM call.
+    
+    Args:
+        state: Raw state vector [x, y, vx, vy, angle, angular_vel, leg1, leg2]
+    
+    Returns:
+        Advice string when the situation is obvious, None when the
+        Navigator's judgment is needed. The text is fixed per regime (the
+        Commander gets the exact numbers from the telemetry), so the
+        decision cache keyed on (telemetry_key, advice) keeps hitting.
+    """
+    vertical_velocity, angle = state[3], state[4]
+    
+    # Badly tilted: STABILIZE FIRST
+    if abs(angle) > 0.3:
+        if angle > 0:
+            return "Tilted right; stabilize with LEFT_ENGINE before descending."
+        return "Tilted left; stabilize with RIGHT_ENGINE before descending."
+    
+    # Upright and falling: brake
+    if vertical_velocity < -1.0 and abs(angle) < 0.1:
+        return "Upright and falling; MAIN_ENGINE to slow the descent."
+    
+    return None
+
 def create_navigator_agent(api_key: str) -> LlmAgent:
     """
     Creates the Navigator Agent using ADK's LlmAgent.
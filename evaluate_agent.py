@@ -3,81 +3,72 @@ import json
 import os
 import numpy as np
 import asyncio
+import sqlite3
+import argparse
 from dotenv import load_dotenv
 from lunar_tools import LunarLanderInterface
-from agents import create_navigator_agent, create_commander_agent
+from agents import (create_navigator_agent, create_commander_agent, cheap_advice, ensure_session,
+                    ask_navigator, ask_commander, RateLimiter, LLM_RPM, ResponseCache, FALLBACK_DECISION)
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.adk.apps.app import App, EventsCompactionConfig
-from google.genai import types
 
-async def run_episode(episode_id, api_key):
+APP_NAME = "lunar_eval"
+USER_ID = "evaluator"
+CACHE_DB = "armstrong_cache.db"
+EVAL_LOG = "evaluation_log.jsonl"
+
+async def run_episode(episode_id, lander, session_service, navigator_runner, commander_runner,
+                      limiter, advice_cache, decision_cache, log_fh):
     print(f"\n--- STARTING EPISODE {episode_id} ---")
     
-    # Initialize Components
-    lander = LunarLanderInterface()
-    navigator = create_navigator_agent(api_key=api_key)
-    commander = create_commander_agent(api_key=api_key)
-    
-    # Create App with Context Compaction
-    app = App(
-        name="lunar_eval",
-        root_agent=navigator,
-        events_compaction_config=EventsCompactionConfig(
-            compaction_interval=10,
-            overlap_size=2
-        )
-    )
-    
-    session_service = InMemorySessionService()
-    navigator_runner = Runner(app=app, session_service=session_service)
-    
-    # Create separate runner for Commander (same session service)
-    commander_runner = Runner(
-        agent=commander,
-        app_name="lunar_eval",
-        session_service=session_service
-    )
+    # Agents, Runners and the gym env are built once in main(); only the
+    # environment state and the sessions are per episode
+    lander.reset()
     
     # Create session
-    APP_NAME = "lunar_eval"
-    USER_ID = "evaluator"
     SESSION_ID = f"eval_episode_{episode_id}"
     
-    # Create sessions for both agents
-    try:
-        nav_session = await session_service.create_session(
-            app_name=APP_NAME,
-            user_id=USER_ID,
-            session_id=SESSION_ID
-        )
-    except:
-        nav_session = await session_service.get_session(
-            app_name=APP_NAME,
-            user_id=USER_ID,
-            session_id=SESSION_ID
-        )
+    # Navigator session (get-or-create)
+    nav_session = await ensure_session(session_service, APP_NAME, USER_ID, SESSION_ID)
     
-    # Commander session
+    # Commander sessions are single-turn: one fresh session per decision,
+    # created and deleted around each call (see _cmd)
     COMMANDER_SESSION_ID = f"{SESSION_ID}_commander"
-    try:
-        cmd_session = await session_service.create_session(
-            app_name=APP_NAME,
-            user_id=USER_ID,
-            session_id=COMMANDER_SESSION_ID
-        )
-    except:
-        cmd_session = await session_service.get_session(
-            app_name=APP_NAME,
-            user_id=USER_ID,
-            session_id=COMMANDER_SESSION_ID
-        )
     
     episode_reward = 0
     step_count = 0
     max_steps = 80 # Limit steps to prevent infinite loops
     
-    mission_log = []
+    async def _nav(telemetry_desc, telemetry_key, state):
+        """Runs the Navigator on a telemetry snapshot and returns its advice."""
+        # Obvious situations are answered by the physics rules directly
+        advice = cheap_advice(state)
+        if advice is not None:
+            return advice
+        
+        # advice_cache is keyed by the coarse telemetry fingerprint, so recurring
+        # situations (hovering, straight fall) skip the LLM round-trip entirely
+        return await advice_cache.get(
+            telemetry_key, lambda: _fetch_advice(telemetry_desc)
+        ) or ""
+    
+    async def _fetch_advice(telemetry_desc):
+        advice = await ask_navigator(navigator_runner, USER_ID, nav_session.id, telemetry_desc, limiter)
+        # Empty advice is returned as None so it is not cached
+        return advice or None
+    
+    async def _cmd(telemetry_desc, telemetry_key, advice):
+        """Runs the Commander on telemetry + advice and returns its decision."""
+        # No decision (e.g. timeout) comes back as None, so it is not cached
+        decision = await decision_cache.get(
+            (telemetry_key, advice),
+            lambda: ask_commander(
+                commander_runner, session_service, APP_NAME, USER_ID,
+                f"{COMMANDER_SESSION_ID}_{step_count}", telemetry_desc, advice, limiter
+            )
+        )
+        return decision or dict(FALLBACK_DECISION)
     
     try:
         while not lander.done and step_count < max_steps:
@@ -85,71 +76,14 @@ async def run_episode(episode_id, api_key):
             
             # A. Get Telemetry
             telemetry_desc = lander.get_telemetry_description()
+            telemetry_key = lander.get_telemetry_key()
             
-            # B. Navigator Analysis (using ADK Runner)
-            navigator_query = types.Content(
-                role="user",
-                parts=[types.Part(text=telemetry_desc)]
-            )
-            
-            advice = ""
-            async for event in navigator_runner.run_async(
-                user_id=USER_ID,
-                session_id=nav_session.id,
-                new_message=navigator_query
-            ):
-                if event.is_final_response() and event.content and event.content.parts:
-                    advice = event.content.parts[0].text
+            # B. Navigator Analysis of this step's telemetry
+            advice = await _nav(telemetry_desc, telemetry_key, lander.current_state)
             
-            # C. Commander Decision (using shared session pattern)
-            commander_prompt = types.Content(
-                role="user",
-                parts=[types.Part(text=f"""
-            Current Telemetry: {telemetry_desc}
-            Navigator Advice: {advice}
-            
-            Determine the best maneuver and execute it using the execute_maneuver tool.
-            """)]
-            )
-            
-            # Use the same Runner pattern with timeout
-            decision = {"action": "HOLD", "duration": 1, "reasoning": "Fallback"}
-            try:
-                # Run Commander with timeout using run_async
-                async def run_commander_with_timeout():
-                    events_list = []
-                    async for event in commander_runner.run_async(
-                        user_id=USER_ID,
-                        session_id=cmd_session.id,
-                        new_message=commander_prompt
-                    ):
-                        events_list.append(event)
-                    return events_list
-                
-                events = await asyncio.wait_for(
-                    run_commander_with_timeout(),
-                    timeout=30.0
-                )
-            except asyncio.TimeoutError:
-                print("[WARNING] Commander timeout - using fallback HOLD")
-                events = []
-            
-            # Extract decision from FIRST function call found
-            found = False
-            for event in events:
-                if found:
-                    break
-                if hasattr(event, 'content') and event.content and event.content.parts:
-                    for part in event.content.parts:
-                        if hasattr(part, 'function_call') and part.function_call:
-                            fn = part.function_call
-                            decision = {
-                                "action": fn.args.get("action", "HOLD"),
-                                "duration": int(fn.args.get("duration", 1)),
-                                "reasoning": fn.args.get("reasoning", "No reasoning provided")
-                            }
-                            found = True
-                            break
+            # C. Commander Decision on the same telemetry + advice. Steps are
+            # sequential; concurrency comes from running episodes in parallel.
+            decision = await _cmd(telemetry_desc, telemetry_key, advice)
             
             # D. Execution
             result = lander.execute_maneuver(decision['action'], decision['duration'])
@@ -157,33 +91,29 @@ async def run_episode(episode_id, api_key):
             
             # E. Logging
             log_entry = {
+                "episode_id": episode_id,
                 "step": step_count,
                 "telemetry": telemetry_desc,
                 "navigator_advice": advice,
                 "commander_decision": decision,
                 "execution_result": result
             }
-            mission_log.append(log_entry)
+            log_fh.write(json.dumps(log_entry) + "\n")
+            log_fh.flush()
             
             print(f"Ep {episode_id} | Step {step_count} | Reward: {episode_reward:.2f} | Action: {decision['action']}")
             
-            # Rate Limit Protection (Safe 9s)
-            await asyncio.sleep(9.0)
-            
     except Exception as e:
         print(f"Episode {episode_id} Error: {e}")
-    finally:
-        lander.close()
         
     return {
         "episode_id": episode_id,
         "total_reward": float(episode_reward),
         "steps": step_count,
-        "success": bool(episode_reward >= 200),
-        "log": mission_log
+        "success": bool(episode_reward >= 200)
     }
 
-async def main():
+async def main(rebuild_cache=False):
     load_dotenv()
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
@@ -191,14 +121,70 @@ async def main():
         return
 
     NUM_EPISODES = 3
-    results = []
+    
+    # Initialize Components once, shared by every episode
+    navigator = create_navigator_agent(api_key=api_key)
+    commander = create_commander_agent(api_key=api_key)
+    
+    # Create App with Context Compaction
+    app = App(
+        name=APP_NAME,
+        root_agent=navigator,
+        events_compaction_config=EventsCompactionConfig(
+            compaction_interval=10,
+            overlap_size=2
+        )
+    )
+    
+    session_service = InMemorySessionService()
+    navigator_runner = Runner(app=app, session_service=session_service)
+    
+    # Create separate runner for Commander (same session service)
+    commander_runner = Runner(
+        agent=commander,
+        app_name=APP_NAME,
+        session_service=session_service
+    )
+    
+    # One lander per concurrently running episode: a gym env can't be shared
+    # between episodes in flight, but it is only reset, never rebuilt
+    landers = [LunarLanderInterface() for _ in range(NUM_EPISODES)]
+    
+    # Rate Limit Protection: one limiter shared by every agent call across all
+    # concurrent episodes, below the 15 RPM free tier (see agents.py)
+    limiter = RateLimiter(rpm=LLM_RPM)
+    
+    # Response caches shared by all episodes: identical concurrent requests
+    # from different episodes are coalesced into a single LLM call.
+    # They persist to disk, so later evaluation runs warm-start.
+    cache_conn = sqlite3.connect(CACHE_DB)
+    advice_cache = ResponseCache(cache_conn, "advice")
+    decision_cache = ResponseCache(cache_conn, "decisions")
+    if rebuild_cache:
+        advice_cache.clear()
+        decision_cache.clear()
     
     print(f"Starting Evaluation of {NUM_EPISODES} episodes...")
     
-    for i in range(1, NUM_EPISODES + 1):
-        result = await run_episode(i, api_key)
-        results.append(result)
-        print(f"Episode {i} Finished. Reward: {result['total_reward']:.2f}, Success: {result['success']}")
+    # Per-step logs of all episodes are streamed to one JSON Lines file,
+    # tagged with their episode_id
+    log_fh = open(EVAL_LOG, "w")
+    
+    # Episodes are independent, so run them concurrently
+    try:
+        results = await asyncio.gather(*(
+            run_episode(i, lander, session_service, navigator_runner, commander_runner,
+                        limiter, advice_cache, decision_cache, log_fh)
+            for i, lander in enumerate(landers, 1)
+        ))
+    finally:
+        for lander in landers:
+            lander.close()
+        cache_conn.close()
+        log_fh.close()
+    
+    for result in results:
+        print(f"Episode {result['episode_id']} Finished. Reward: {result['total_reward']:.2f}, Success: {result['success']}")
         
     # Calculate Metrics
     rewards = [r["total_reward"] for r in results]
@@ -214,12 +200,20 @@ async def main():
     report = {
         "average_reward": avg_reward,
         "success_rate": success_rate,
-        "episodes": results
+        "episodes": results,
+        "log_file": EVAL_LOG
     }
     
     with open("evaluation_report.json", "w") as f:
         json.dump(report, f, indent=2)
-    print("Detailed report saved to 'evaluation_report.json'")
+    print(f"Report saved to 'evaluation_report.json', step logs in '{EVAL_LOG}'")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Evaluate the Armstrong agents over several episodes.")
+    parser.add_argument(
+        "--rebuild-cache",
+        action="store_true",
+        help=f"Discard the advice/decision cache in {CACHE_DB} before running"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(rebuild_cache=args.rebuild_cache))
@@ -1,124 +1,235 @@
 import gymnasium as gym
 import numpy as np
 import json
+import atexit
 import imageio
-from typing import Dict, Any
+import Box2D  # noqa: F401 - import upfront so the first env.step doesn't pay for it
+from typing import Dict, Any, NamedTuple
+
+# Idle LunarLander envs. gym.make is expensive (registry lookup, Box2D world,
+# pygame surfaces), so closed interfaces hand their env back here for the next
+# one created in this process; envs are only really closed at exit.
+_ENV_POOL = []
+
+def _acquire_env():
+    if _ENV_POOL:
+        return _ENV_POOL.pop()
+    return gym.make('LunarLander-v2', render_mode="rgb_array")
+
+def _release_env(env):
+    _ENV_POOL.append(env)
+
+@atexit.register
+def _close_pooled_envs():
+    while _ENV_POOL:
+        _ENV_POOL.pop().close()
+
+class Telemetry(NamedTuple):
+    """Readable telemetry; use _asdict() where a JSON object is needed."""
+    altitude: float
+    horizontal_position: float
+    vertical_velocity: float
+    horizontal_velocity: float
+    angle: float
+    angular_velocity: float
+    left_leg_contact: bool
+    right_leg_contact: bool
+    steps_taken: int
+
+_TELEMETRY_TEMPLATE = (
+    "Altitude: {:.2f}. "
+    "Position X: {:.2f} (0 is center). "
+    "Vertical Velocity: {:.2f} (Negative is falling). "
+    "Horizontal Velocity: {:.2f}. "
+    "Angle: {:.2f} radians. "
+    "Status: {}."
+)
+
+def _format_telemetry(s: np.ndarray) -> str:
+    """
+    Formats the raw state vector [x, y, vx, vy, angle, angular_vel, leg1, leg2]
+    as the natural language description, without building the telemetry dict.
+    """
+    return _TELEMETRY_TEMPLATE.format(
+        s[1], s[0], s[3], s[2], s[4],
+        "Touchdown imminent/Landed" if s[6] or s[7] else "Flying"
+    )
+
+def _burst(step, action_code, duration, render=None, append_frame=None):
+    """
+    Runs up to `duration` env steps with a fixed action, streaming rendered
+    frames to `append_frame` when recording. Intermediate observations are
+    never inspected, so the loop only touches locals.
+    Returns (final_state, reward_sum, done, steps).
+    """
+    state = None
+    reward_sum = 0
+    done = False
+    steps = 0
+    
+    while steps < duration and not done:
+        state, reward, terminated, truncated, _ = step(action_code)
+        done = terminated or truncated
+        reward_sum += reward
+        steps += 1
+        
+        # Capture frame
+        if append_frame is not None:
+            frame = render()
+            if frame is not None:
+                append_frame(frame)
+    
+    return state, reward_sum, done, steps
 
 class LunarLanderInterface:
-    def __init__(self):
-        self.env = gym.make('LunarLander-v2', render_mode="rgb_array")
+    # Actions: 0: Do nothing, 1: Fire right engine (push left), 2: Main engine, 3: Left engine (push right)
+    _ACTION_MAP = {
+        "HOLD": 0,
+        "MAIN_ENGINE": 2,
+        "LEFT_ENGINE": 3, # Fires left engine, pushes lander to the RIGHT
+        "RIGHT_ENGINE": 1 # Fires right engine, pushes lander to the LEFT
+    }
+
+    def __init__(self, video_path=None, fps=30):
+        self.env = _acquire_env()
         self.current_state, _ = self.env.reset()
         self.total_reward = 0
         self.steps = 0
         self.done = False
-        self.frames = [] # Store frames for video
+        self._last_desc = None
+        
+        # Video is only recorded when a path is given. Frames are streamed to
+        # an ffmpeg writer as they are rendered, so none are kept in memory.
+        self.video_path = video_path
+        self.fps = fps
+        self._writer = None
 
     def reset(self):
         self.current_state, _ = self.env.reset()
         self.total_reward = 0
         self.steps = 0
         self.done = False
-        self.frames = []
+        self._last_desc = None
+        self._close_writer()
         return self.get_telemetry()
 
     def get_telemetry(self):
         """
         Extracts readable telemetry from the state vector.
         State vector: [x, y, vx, vy, angle, angular_vel, leg1, leg2]
+        Not used on the per-step description path, see _format_telemetry.
         """
-        s = self.current_state
-        
         # Interpret values for the LLM
         # x: 0 is center. -1 is left, 1 is right.
         # y: 0 is landing pad (approx), starts at ~1.4
         # angle: 0 is upright.
         
-        telemetry = {
-            "altitude": float(s[1]),
-            "horizontal_position": float(s[0]),
-            "vertical_velocity": float(s[3]),
-            "horizontal_velocity": float(s[2]),
-            "angle": float(s[4]),
-            "angular_velocity": float(s[5]),
-            "left_leg_contact": bool(s[6]),
-            "right_leg_contact": bool(s[7]),
-            "steps_taken": self.steps
-        }
-        return telemetry
+        # One bulk C-level conversion instead of a float() per element
+        x, y, vx, vy, angle, angular_vel, leg1, leg2 = self.current_state.tolist()
+        return Telemetry(
+            y, x, vy, vx, angle, angular_vel, bool(leg1), bool(leg2), self.steps
+        )
 
     def get_telemetry_description(self):
         """
         Returns a natural language description of the state for the Navigator agent.
+        The string is cached until the next maneuver changes the state.
+        """
+        if self._last_desc is None:
+            self._last_desc = _format_telemetry(self.current_state)
+        return self._last_desc
+
+    def get_telemetry_key(self):
+        """
+        Returns a coarse (1 decimal) fingerprint of the state.
+        Nearby states share a key, so it is used to cache agent responses
+        while the full-precision description is still sent to the LLM.
         """
         t = self.get_telemetry()
         
-        desc = f"Altitude: {t['altitude']:.2f}. "
-        desc += f"Position X: {t['horizontal_position']:.2f} (0 is center). "
-        desc += f"Vertical Velocity: {t['vertical_velocity']:.2f} (Negative is falling). "
-        desc += f"Horizontal Velocity: {t['horizontal_velocity']:.2f}. "
-        desc += f"Angle: {t['angle']:.2f} radians. "
-        
-        status = "Flying"
-        if t['left_leg_contact'] or t['right_leg_contact']:
-            status = "Touchdown imminent/Landed"
-            
-        desc += f"Status: {status}."
-        return desc
+        return (
+            f"{t.altitude:.1f}|{t.horizontal_position:.1f}|"
+            f"{t.vertical_velocity:.1f}|{t.horizontal_velocity:.1f}|"
+            f"{t.angle:.1f}|{t.left_leg_contact or t.right_leg_contact}"
+        )
 
     def execute_maneuver(self, action_name, duration=1):
         """
         Executes an action for a specific number of frames.
         Actions: 0: Do nothing, 1: Fire right engine (push left), 2: Main engine, 3: Left engine (push right)
         """
-        action_map = {
-            "HOLD": 0,
-            "MAIN_ENGINE": 2,
-            "LEFT_ENGINE": 3, # Fires left engine, pushes lander to the RIGHT
-            "RIGHT_ENGINE": 1 # Fires right engine, pushes lander to the LEFT
-        }
-        
-        action_code = action_map.get(action_name, 0)
+        action_code = self._ACTION_MAP.get(action_name, 0)
         
         step_rewards = 0
-        info_log = []
+        self._last_desc = None
         
-        for _ in range(duration):
-            if self.done:
-                break
-                
-            next_state, reward, terminated, truncated, info = self.env.step(action_code)
-            self.done = terminated or truncated
-            self.current_state = next_state
-            self.total_reward += reward
-            self.steps += 1
-            step_rewards += reward
-            
-            # Capture frame
-            frame = self.env.render()
-            if frame is not None:
-                self.frames.append(frame)
+        # Lazily start the video stream on the first maneuver
+        if self.video_path and self._writer is None:
+            try:
+                self._writer = imageio.get_writer(
+                    self.video_path, fps=self.fps, codec="libx264",
+                    quality=6, macro_block_size=1
+                )
+            except Exception as e:
+                # Keep flying without a recording rather than aborting
+                print(f"Error starting video recording: {e}")
+                self.video_path = None
+        append_frame = self._append_frame if self._writer else None
+        
+        if not self.done:
+            state, step_rewards, self.done, steps = _burst(
+                self.env.step, action_code, duration,
+                self.env.render, append_frame
+            )
+            if steps:
+                self.current_state = state
+                self.total_reward += step_rewards
+                self.steps += steps
 
         return {
-            "final_telemetry": self.get_telemetry(),
+            "final_telemetry": self.get_telemetry()._asdict(),
             "reward_accumulated": step_rewards,
             "done": self.done,
             "action_executed": action_name,
             "duration": duration
         }
 
+    def _append_frame(self, frame):
+        if self._writer is None:
+            return
+        try:
+            self._writer.append_data(frame)
+        except Exception as e:
+            # Same as a failed start: drop the recording, keep flying
+            print(f"Error recording video: {e}")
+            writer, self._writer = self._writer, None
+            self.video_path = None
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    def _close_writer(self):
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
     def close(self):
-        self.env.close()
+        self._close_writer()
+        if self.env is not None:
+            _release_env(self.env)
+            self.env = None
 
-    def save_video(self, filename="mission_replay.mp4", fps=30):
+    def save_video(self):
         """
-        Saves the recorded frames to a video file.
+        Finalizes the video file that frames were streamed to.
         """
-        if not self.frames:
+        if self._writer is None:
             print("No frames to save.")
             return
         
         try:
-            imageio.mimsave(filename, self.frames, fps=fps)
-            print(f"Video saved to {filename}")
+            self._close_writer()
+            print(f"Video saved to {self.video_path}")
         except Exception as e:
             print(f"Error saving video: {e}")
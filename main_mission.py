@@ -4,11 +4,11 @@ import os
 from dotenv import load_dotenv
 from typing import Dict, Any
 from lunar_tools import LunarLanderInterface
-from agents import create_navigator_agent, create_commander_agent
+from agents import (create_navigator_agent, create_commander_agent, cheap_advice, ensure_session,
+                    ask_navigator, ask_commander, RateLimiter, LLM_RPM, FALLBACK_DECISION)
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.adk.apps.app import App, EventsCompactionConfig
-from google.genai import types
 import asyncio
 
 async def main():
@@ -24,7 +24,7 @@ async def main():
         return {"status": "ABORTED", "error": "No API key"}
     
     # Initialize Components
-    lander = LunarLanderInterface()
+    lander = LunarLanderInterface(video_path="mission_replay.mp4")
     
     # Create ADK agents
     navigator = create_navigator_agent(api_key=api_key)
@@ -61,41 +61,42 @@ async def main():
     USER_ID = "mission_control"
     SESSION_ID = "flight_001"
     
-    mission_log = []
+    # Mission log is streamed as JSON Lines, one entry per step, so progress
+    # can be tailed live and nothing accumulates in memory
+    log_fh = open("mission_log.jsonl", "w")
     episode_reward = 0
     
+    # Rate Limit Protection:
+    # Every Navigator/Commander request takes a slot; we only wait when the
+    # last minute is already full. LLM_RPM stays below the 15 RPM free tier
+    # (see agents.py).
+    limiter = RateLimiter(rpm=LLM_RPM)
+    
     print("Mission Start. Initializing systems...")
     time.sleep(1)
     
-    # Create sessions for both agents
-    # Navigator session for strategic advice
-    try:
-        nav_session = await session_service.create_session(
-            app_name=APP_NAME,
-            user_id=USER_ID,
-            session_id=SESSION_ID
-        )
-    except:
-        nav_session = await session_service.get_session(
-            app_name=APP_NAME,
-            user_id=USER_ID,
-            session_id=SESSION_ID
-        )
+    # Navigator session for strategic advice (get-or-create)
+    nav_session = await ensure_session(session_service, APP_NAME, USER_ID, SESSION_ID)
     
-    # Commander session for tactical decisions
+    # Commander sessions are single-turn: one fresh session per decision,
+    # created and deleted around each call (see _cmd)
     COMMANDER_SESSION_ID = f"{SESSION_ID}_commander"
-    try:
-        cmd_session = await session_service.create_session(
-            app_name=APP_NAME,
-            user_id=USER_ID,
-            session_id=COMMANDER_SESSION_ID
-        )
-    except:
-        cmd_session = await session_service.get_session(
-            app_name=APP_NAME,
-            user_id=USER_ID,
-            session_id=COMMANDER_SESSION_ID
+    
+    async def _nav(telemetry_desc, state):
+        """Runs the Navigator on a telemetry snapshot and returns its advice."""
+        # Obvious situations are answered by the physics rules directly
+        advice = cheap_advice(state)
+        if advice is not None:
+            return advice
+        return await ask_navigator(navigator_runner, USER_ID, nav_session.id, telemetry_desc, limiter)
+    
+    async def _cmd(telemetry_desc, advice):
+        """Runs the Commander on telemetry + advice and returns its decision."""
+        decision = await ask_commander(
+            commander_runner, session_service, APP_NAME, USER_ID,
+            f"{COMMANDER_SESSION_ID}_{step_count}", telemetry_desc, advice, limiter
         )
+        return decision or dict(FALLBACK_DECISION)
     
     # 2. Mission Loop
     max_steps = 100 # Safety limit for the demo
@@ -110,74 +111,14 @@ async def main():
             telemetry_desc = lander.get_telemetry_description()
             print(f"[TELEMETRY] {telemetry_desc}")
             
-            # B. Navigator Analysis (using ADK Runner with session)
+            # B. Navigator Analysis of this step's telemetry
             print("[NAVIGATOR] Analyzing...")
-            navigator_query = types.Content(
-                role="user",
-                parts=[types.Part(text=telemetry_desc)]
-            )
-            
-            advice = ""
-            async for event in navigator_runner.run_async(
-                user_id=USER_ID,
-                session_id=nav_session.id,
-                new_message=navigator_query
-            ):
-                if event.is_final_response() and event.content and event.content.parts:
-                    advice = event.content.parts[0].text
-                    
+            advice = await _nav(telemetry_desc, lander.current_state)
             print(f"[NAVIGATOR] Advice: {advice}")
             
-            # C. Commander Decision (using shared session pattern)
+            # C. Commander Decision on the same telemetry + advice
             print("[COMMANDER] Deciding maneuver...")
-            commander_prompt = types.Content(
-                role="user",
-                parts=[types.Part(text=f"""
-            Current Telemetry: {telemetry_desc}
-            Navigator Advice: {advice}
-            
-            Determine the best maneuver and execute it using the execute_maneuver tool.
-            """)]
-            )
-            
-            # Use the same Runner pattern with timeout
-            decision = {"action": "HOLD", "duration": 1, "reasoning": "Fallback"}
-            try:
-                # Run Commander with timeout using run_async
-                async def run_commander_with_timeout():
-                    events_list = []
-                    async for event in commander_runner.run_async(
-                        user_id=USER_ID,
-                        session_id=cmd_session.id,
-                        new_message=commander_prompt
-                    ):
-                        events_list.append(event)
-                    return events_list
-                
-                events = await asyncio.wait_for(
-                    run_commander_with_timeout(),
-                    timeout=30.0
-                )
-            except asyncio.TimeoutError:
-                print("[WARNING] Commander timeout - using fallback HOLD")
-                events = []
-            
-            # Extract decision from FIRST function call found
-            found = False
-            for event in events:
-                if found:
-                    break
-                if hasattr(event, 'content') and event.content and event.content.parts:
-                    for part in event.content.parts:
-                        if hasattr(part, 'function_call') and part.function_call:
-                            fn = part.function_call
-                            decision = {
-                                "action": fn.args.get("action", "HOLD"),
-                                "duration": int(fn.args.get("duration", 1)),
-                                "reasoning": fn.args.get("reasoning", "No reasoning provided")
-                            }
-                            found = True
-                            break
+            decision = await _cmd(telemetry_desc, advice)
                         
             print(f"[COMMANDER] Action: {decision['action']} for {decision['duration']} frames.")
             print(f"[COMMANDER] Reasoning: {decision['reasoning']}")
@@ -194,14 +135,8 @@ async def main():
                 "commander_decision": decision,
                 "execution_result": result
             }
-            mission_log.append(log_entry)
-            
-            # Rate Limit Protection:
-            # Gemini 2.5 Flash-Lite Free Tier allows 15 RPM.
-            # We make 2 requests per step (Navigator + Commander).
-            # So we can do max 7.5 steps per minute = 1 step every 8 seconds.
-            # We sleep for 9 seconds to be safe.
-            await asyncio.sleep(9.0) 
+            log_fh.write(json.dumps(log_entry) + "\n")
+            log_fh.flush()
             
         # 3. Mission End
         print("\n--- MISSION END ---")
@@ -221,7 +156,7 @@ async def main():
             "status": result_status,
             "total_reward": episode_reward,
             "steps": step_count,
-            "log": mission_log
+            "log_file": "mission_log.jsonl"
         }
             
     except KeyboardInterrupt:
@@ -229,13 +164,12 @@ async def main():
         return {"status": "ABORTED", "total_reward": episode_reward, "steps": step_count}
     finally:
         # Save Logs
-        with open("mission_log.json", "w") as f:
-            json.dump(mission_log, f, indent=2)
-        print("Mission logs saved to 'mission_log.json'.")
+        log_fh.close()
+        print("Mission logs saved to 'mission_log.jsonl'.")
         
         # Save Video
         print("Saving mission replay...")
-        lander.save_video("mission_replay.mp4")
+        lander.save_video()
         
         lander.close()
 
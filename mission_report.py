@@ -1,36 +1,155 @@
-import json
+import os
 import sys
+import hashlib
 
-def generate_report(log_file="mission_log.json"):
+# orjson parses several times faster when installed; stdlib json otherwise.
+# Both accept bytes.
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+_loads = _json.loads
+
+# pysimdjson, when installed, parses array-format logs into lazy proxies:
+# only the fields the report reads are ever turned into Python objects.
+# The parser is reused across calls.
+try:
+    import simdjson
+    _parser = simdjson.Parser()
+except ImportError:
+    _parser = None
+
+# Without pysimdjson, ijson (when installed) streams array-format logs
+# entry by entry, so they no longer have to be loaded whole either.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+_REPORT_FILE = "mission_report.md"
+_HEADER = "# Mission Report: Project Armstrong\n\n## Flight Transcript\n\n"
+
+def _format_entry(entry):
+    """Formats one mission log entry as its Markdown transcript section."""
+    step = entry['step']
+    telemetry = entry['telemetry']
+    advice = entry['navigator_advice']
+    decision = entry['commander_decision']
+    result = entry['execution_result']
+    
+    # One level deeper: bind the nested fields the entry text uses
+    action = decision['action']
+    duration = decision['duration']
+    reasoning = decision['reasoning']
+    altitude = result['final_telemetry']['altitude']
+    reward = result['reward_accumulated']
+    
+    # Adjacent f-string literals compile to one BUILD_STRING per entry. The
+    # two floats are formatted inline: a batched np.char.mod("%.2f", ...)
+    # pass is ~3x slower, as it calls back into Python's % per element.
+    return (
+        f"### T-Minus {step}\n"
+        f"**Telemetry**: {telemetry}\n\n"
+        f"**Navigator**: *\"{advice}\"*\n\n"
+        f"**Commander**: **{action}** ({duration} frames)\n"
+        f"> *Reasoning: {reasoning}*\n\n"
+        f"**Outcome**: Altitude {altitude:.2f} | Reward: {reward:.2f}\n"
+        "---\n"
+    )
+
+def _iter_entries(f):
+    """
+    Yields the entries of an open (binary) log file. JSON Lines, as streamed
+    by main_mission.py, are parsed line by line as they are read, so memory
+    stays bounded by one entry. A file starting with "[" is the older array
+    format: parsed whole by pysimdjson when installed, else streamed with
+    ijson when installed, else parsed whole by orjson/json.
+    """
+    if f.peek(1).lstrip()[:1] == b"[":
+        if _parser is None and ijson is not None:
+            # use_float: floats as float, not Decimal, for the ".2f" fields
+            yield from ijson.items(f, "item", use_float=True)
+        else:
+            data = f.read()
+            yield from (_parser.parse(data) if _parser is not None else _loads(data))
+    else:
+        # Iterating the file splits on newlines in C, no readline() calls
+        for line in f:
+            if line.strip():
+                yield _loads(line)
+
+def _log_sentinel(log_file, st):
+    """
+    First line of the report: an HTML comment (invisible once rendered)
+    identifying the log it was generated from, with that log's mtime and
+    size. The path is hashed so the shareable report doesn't reveal the
+    local directory layout.
+    """
+    path_hash = hashlib.sha256(os.fsencode(os.path.abspath(log_file))).hexdigest()[:16]
+    return f"<!-- log: {path_hash} {st.st_mtime_ns} {st.st_size} -->\n"
+
+def _report_is_current(sentinel):
     try:
-        with open(log_file, "r") as f:
-            logs = json.load(f)
+        with open(_REPORT_FILE, encoding="utf-8", errors="replace") as f:
+            return f.readline() == sentinel
     except FileNotFoundError:
+        return False
+
+def generate_report(log_file=None):
+    # Logs are streamed as JSON Lines now; older runs (and the checked-in
+    # sample) left a JSON array in mission_log.json, used when there is no
+    # mission_log.jsonl
+    if log_file is None:
+        candidates = ("mission_log.jsonl", "mission_log.json")
+    else:
+        candidates = (log_file,)
+    
+    # The stat both checks that the log exists and gives the mtime/size for
+    # the sentinel, so the default path costs one stat (two with no .jsonl).
+    # Taken before reading: if the log is still being appended to, the
+    # sentinel records the older state and the next run regenerates.
+    for log_file in candidates:
+        try:
+            st = os.stat(log_file)
+            break
+        except FileNotFoundError:
+            pass
+    else:
         print("Log file not found. Run the mission first!")
         return
+    sentinel = _log_sentinel(log_file, st)
+    
+    # Unchanged log: the existing report is identical, skip the work
+    if _report_is_current(sentinel):
+        print(f"Report up to date: {_REPORT_FILE}")
+        return
+    
+    log = open(log_file, "rb", buffering=1 << 20)
 
-    report = "# Mission Report: Project Armstrong\n\n"
-    report += "## Flight Transcript\n\n"
+    # Written to a temporary file and renamed once complete, so a failure
+    # halfway never leaves a partial report carrying a valid sentinel
+    tmp_file = _REPORT_FILE + ".tmp"
     
-    for entry in logs:
-        step = entry['step']
-        telemetry = entry['telemetry']
-        advice = entry['navigator_advice']
-        decision = entry['commander_decision']
-        result = entry['execution_result']
-        
-        report += f"### T-Minus {step}\n"
-        report += f"**Telemetry**: {telemetry}\n\n"
-        report += f"**Navigator**: *\"{advice}\"*\n\n"
-        report += f"**Commander**: **{decision['action']}** ({decision['duration']} frames)\n"
-        report += f"> *Reasoning: {decision['reasoning']}*\n\n"
-        report += f"**Outcome**: Altitude {result['final_telemetry']['altitude']:.2f} | Reward: {result['reward_accumulated']:.2f}\n"
-        report += "---\n"
-
-    with open("mission_report.md", "w") as f:
-        f.write(report)
+    # Stream each entry straight to disk instead of materializing the whole
+    # report; the 1 MiB buffer batches the small writes into few syscalls.
+    # Always UTF-8 with "\n" newlines, so there is no per-write newline
+    # translation and no locale codec (e.g. cp1252 on Windows) that LLM text
+    # could fail to encode in.
+    try:
+        with log, open(tmp_file, "w", encoding="utf-8", newline="\n", buffering=1 << 20) as f:
+            f.write(sentinel)
+            f.write(_HEADER)
+            for entry in _iter_entries(log):
+                f.write(_format_entry(entry))
+        os.replace(tmp_file, _REPORT_FILE)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
     
-    print("Report generated: mission_report.md")
+    print(f"Report generated: {_REPORT_FILE}")
 
 if __name__ == "__main__":
-    generate_report()
+    # Optional log file argument; defaults to mission_log.jsonl, falling
+    # back to mission_log.json
+    generate_report(*sys.argv[1:2])